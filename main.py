@@ -3,9 +3,10 @@ import ipaddress
 import json
 import os
 import re
+import signal
 import time
 from contextlib import suppress
-from typing import Any
+from typing import Any, NamedTuple
 
 import decky
 
@@ -15,13 +16,18 @@ DEFAULT_CONFIG: dict[str, Any] = {
     'tcp_mode': False,
 }
 
-WAITING_ATTEMPT_RE = re.compile(
-    r'timed out waiting for data from server(?:; attempt (\d+))?',
+LOG_EVENT_RE = re.compile(
+    r'(?P<connected>^connected$)'
+    r'|(?P<waiting>timed out waiting for data from server(?:; attempt (?P<attempt>\d+))?)'
+    r'|(?P<reset>connection reset|connection closed)',
     re.IGNORECASE,
 )
+IP_ADDRESS_CHARS = frozenset('0123456789abcdefABCDEF.:')
 WAITING_STATUS_PREFIX = 'Wait for server attempt: '
 WAITING_TO_CONNECTED_QUIET_SECONDS = 1.5
 AWIM_STOP_TIMEOUT_SECONDS = 3.0
+AWIM_STREAM_READ_SIZE = 65536
+AWIM_LOG_COALESCE_SECONDS = 0.25
 ERROR_STATUS_RULES = [
     {
         'exit_code': 255,
@@ -91,27 +97,45 @@ SPA_PLUGIN_DIR_CANDIDATES = [
 ]
 
 
+class ConnectionStatus(NamedTuple):
+    status: str
+    waiting_attempt: int | None = None
+    error_code: int | None = None
+    waiting_signal_at: float | None = None
+
+
 class Plugin:
     def __init__(self):
         self.settings_path = ''
         self.config: dict[str, Any] = DEFAULT_CONFIG.copy()
+        self._last_saved_config: bytes | None = None
+        self._state_base: dict[str, Any] = {}
+        self._awim_argv_tail: list[str] = []
+        self._refresh_config_cache()
 
         self.awim_process: asyncio.subprocess.Process | None = None
         self.awim_stdout_task: asyncio.Task[None] | None = None
         self.awim_stderr_task: asyncio.Task[None] | None = None
         self.awim_exit_task: asyncio.Task[None] | None = None
         self._stopping_awim = False
+        self._last_log_key: tuple[str, str] | None = None
+        self._last_log_at = 0.0
+        self._repeated_log_count = 0
+        self._repeated_log_message = ''
+        self._repeated_log_flush: asyncio.TimerHandle | None = None
 
-        self.connection_status = 'Stopped'
-        self.waiting_attempt: int | None = None
-        self.error_code: int | None = None
-        self.last_waiting_signal_at: float | None = None
+        self._status = ConnectionStatus('Stopped')
         self._error_markers: set[str] = set()
 
+        self._awim_binary: str | None = None
+        self._awim_env: dict[str, str] | None = None
+
     async def _main(self):
         os.makedirs(decky.DECKY_PLUGIN_SETTINGS_DIR, exist_ok=True)
         self.settings_path = os.path.join(decky.DECKY_PLUGIN_SETTINGS_DIR, 'settings.json')
         self.config = self._load_config()
+        self._refresh_config_cache()
+        self._awim_env = self._build_awim_env()
         decky.logger.info('AWiM Deck initialized with %s:%s', self.config['ip'], self.config['port'])
 
     async def _unload(self):
@@ -143,6 +167,7 @@ class Plugin:
 
         self.config['ip'] = address
         self.config['port'] = port
+        self._refresh_config_cache()
         self._save_config()
         return self._state()
 
@@ -151,6 +176,7 @@ class Plugin:
             raise ValueError('tcp_mode must be a boolean value.')
 
         self.config['tcp_mode'] = tcp_mode
+        self._refresh_config_cache()
         self._save_config()
         return self._state()
 
@@ -166,21 +192,37 @@ class Plugin:
             raise RuntimeError(str(error)) from error
 
     def _state(self) -> dict[str, Any]:
-        self._refresh_process_state()
-        self._infer_connected_after_waiting_quiet_period()
+        self._sync_process_status()
 
         process = self.awim_process
-        return {
+        state = self._state_base.copy()
+        state['running'] = process is not None
+        state['pid'] = process.pid if process is not None else None
+        status = self._status
+        state['status'] = status.status
+        state['attempt'] = status.waiting_attempt
+        state['error_code'] = status.error_code
+        return state
+
+    def _refresh_config_cache(self):
+        self._state_base = {
             'ip': self.config['ip'],
             'port': self.config['port'],
             'tcp_mode': self.config['tcp_mode'],
-            'running': process is not None,
-            'pid': process.pid if process is not None else None,
-            'status': self.connection_status,
-            'attempt': self.waiting_attempt,
-            'error_code': self.error_code,
         }
 
+        argv_tail = ['--ip', self.config['ip'], '--port', str(self.config['port'])]
+        if self.config['tcp_mode']:
+            argv_tail.append('--tcp-mode')
+        self._awim_argv_tail = argv_tail
+
+    def _sync_process_status(self):
+        if self.awim_process is None and self._status.status == 'Stopped':
+            return
+
+        self._refresh_process_state()
+        self._infer_connected_after_waiting_quiet_period()
+
     def _set_status(
         self,
         status: str,
@@ -189,10 +231,12 @@ class Plugin:
         error_code: int | None = None,
         mark_waiting: bool = False,
     ):
-        self.connection_status = status
-        self.waiting_attempt = waiting_attempt
-        self.error_code = error_code
-        self.last_waiting_signal_at = time.monotonic() if mark_waiting else None
+        self._status = ConnectionStatus(
+            status,
+            waiting_attempt,
+            error_code,
+            time.monotonic() if mark_waiting else None,
+        )
 
     def _set_stopped_status(self):
         self._set_status('Stopped')
@@ -247,12 +291,13 @@ class Plugin:
     def _infer_connected_after_waiting_quiet_period(self):
         if self.awim_process is None:
             return
-        if not self.connection_status.startswith(WAITING_STATUS_PREFIX):
+        status = self._status
+        if not status.status.startswith(WAITING_STATUS_PREFIX):
             return
-        if self.last_waiting_signal_at is None:
+        if status.waiting_signal_at is None:
             return
 
-        quiet_seconds = time.monotonic() - self.last_waiting_signal_at
+        quiet_seconds = time.monotonic() - status.waiting_signal_at
         if quiet_seconds < WAITING_TO_CONNECTED_QUIET_SECONDS:
             return
 
@@ -264,9 +309,9 @@ class Plugin:
             return config
 
         try:
-            with open(self.settings_path, 'r', encoding='utf-8') as file:
-                loaded = json.load(file)
-        except (OSError, json.JSONDecodeError) as error:
+            with open(self.settings_path, 'rb') as file:
+                loaded = json.loads(file.read())
+        except (OSError, UnicodeDecodeError, json.JSONDecodeError) as error:
             decky.logger.warning('Failed to read settings: %s', error)
             return config
 
@@ -288,13 +333,29 @@ class Plugin:
         return config
 
     def _save_config(self):
-        with open(self.settings_path, 'w', encoding='utf-8') as file:
-            json.dump(self.config, file, indent=2)
+        serialized = json.dumps(self.config, indent=2).encode('utf-8')
+        if serialized == self._last_saved_config:
+            return
+
+        tmp_path = f'{self.settings_path}.tmp'
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(serialized)
+            os.replace(tmp_path, self.settings_path)
+        except OSError:
+            with suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+        self._last_saved_config = serialized
 
     @staticmethod
     def _is_valid_ip(address: str) -> bool:
         if not isinstance(address, str):
             return False
+        # IPv6 scope ids (after '%') may contain arbitrary interface names.
+        host = address.partition('%')[0]
+        if not host or not IP_ADDRESS_CHARS.issuperset(host):
+            return False
         try:
             ipaddress.ip_address(address)
             return True
@@ -308,8 +369,12 @@ class Plugin:
         return 1024 <= port <= 65535
 
     def _awim_path(self) -> str:
+        if self._awim_binary is not None:
+            return self._awim_binary
+
         path = os.path.join(decky.DECKY_PLUGIN_DIR, 'bin', 'awim')
         if os.path.isfile(path):
+            self._awim_binary = path
             return path
         raise FileNotFoundError(
             'Could not find awim binary at bin/awim. '
@@ -327,14 +392,15 @@ class Plugin:
         await self._cancel_process_tasks()
 
         awim_path = self._awim_path()
-        env = self._build_awim_env()
-        args = [awim_path, '--ip', self.config['ip'], '--port', str(self.config['port'])]
-        if self.config['tcp_mode']:
-            args.append('--tcp-mode')
+        env = self._get_awim_env()
+        args = [awim_path, *self._awim_argv_tail]
 
         self._set_waiting_status(1)
         self._stopping_awim = False
         self._error_markers.clear()
+        self._flush_repeated_log()
+        self._last_log_key = None
+        self._last_log_at = 0.0
 
         try:
             process = await asyncio.create_subprocess_exec(
@@ -342,8 +408,10 @@ class Plugin:
                 env=env,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
             )
         except FileNotFoundError as error:
+            self._awim_binary = None
             if os.path.isfile(awim_path):
                 raise RuntimeError(
                     'awim exists but failed to start. Likely incompatible binary for SteamOS '
@@ -396,57 +464,135 @@ class Plugin:
             return
 
         self._stopping_awim = True
-        with suppress(ProcessLookupError):
-            process.terminate()
+        self._signal_process_group(process, signal.SIGTERM)
 
         try:
             await asyncio.wait_for(process.wait(), timeout=AWIM_STOP_TIMEOUT_SECONDS)
             decky.logger.info('awim stopped with SIGTERM')
         except TimeoutError:
-            with suppress(ProcessLookupError):
-                process.kill()
+            killed = self._signal_process_group(process, signal.SIGKILL)
             await process.wait()
-            decky.logger.info('awim stopped with SIGKILL')
+            if killed:
+                decky.logger.info('awim stopped with SIGKILL')
+            else:
+                decky.logger.info('awim stopped after SIGTERM timeout')
         finally:
             self.awim_process = None
             self._stopping_awim = False
             self._set_stopped_status()
             await self._cancel_process_tasks()
 
+    @staticmethod
+    def _signal_process_group(process: asyncio.subprocess.Process, sig: signal.Signals) -> bool:
+        # Signal the group even after awim itself exits: its helpers may still hold the pipes.
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return False
+        return True
+
     async def _consume_stream(self, stream: asyncio.StreamReader | None, stream_name: str):
         if stream is None:
             return
 
-        while True:
-            line = await stream.readline()
-            if not line:
-                return
-
-            message = line.decode(errors='replace').strip()
-            if not message:
-                continue
-
-            if stream_name == 'stderr':
-                self._collect_error_markers(message)
+        buffer = bytearray()
+        try:
+            while True:
+                chunk = await stream.read(AWIM_STREAM_READ_SIZE)
+                if not chunk:
+                    break
+
+                newline = chunk.rfind(b'\n')
+                if newline < 0:
+                    buffer.extend(chunk)
+                    # Cap an unterminated line like readline()'s limit instead of growing forever.
+                    if len(buffer) >= AWIM_STREAM_READ_SIZE:
+                        self._handle_log_line(bytes(buffer), stream_name)
+                        buffer.clear()
+                    continue
+
+                end = len(buffer) + newline
+                buffer.extend(chunk)
+                lines = buffer[:end].split(b'\n')
+                del buffer[:end + 1]
+                for line in lines:
+                    self._handle_log_line(line, stream_name)
+
+            if buffer:
+                self._handle_log_line(bytes(buffer), stream_name)
+        finally:
+            self._flush_repeated_log()
 
-            decky.logger.info('awim %s: %s', stream_name, message)
-            self._update_connection_status_from_log(message)
+    def _handle_log_line(self, line: bytes, stream_name: str):
+        stripped = line.strip()
+        if not stripped:
+            return
 
-    def _update_connection_status_from_log(self, message: str):
-        if re.fullmatch(r'Connected', message, re.IGNORECASE):
-            self._set_connected_status()
+        message = stripped.decode('utf-8', errors='replace')
+
+        if stream_name == 'stderr':
+            self._collect_error_markers(message)
+
+        event = self._update_connection_status_from_log(message)
+        self._log_stream_message(stream_name, message, event)
+
+    def _log_stream_message(self, stream_name: str, message: str, event: str | None):
+        now = time.monotonic()
+        # Lines with a status event coalesce by event, so 'attempt N' storms merge too.
+        log_key = (stream_name, event if event is not None else message)
+        elapsed = now - self._last_log_at
+        if log_key == self._last_log_key and elapsed < AWIM_LOG_COALESCE_SECONDS:
+            self._repeated_log_count += 1
+            self._repeated_log_message = message
+            if self._repeated_log_flush is None:
+                self._repeated_log_flush = asyncio.get_running_loop().call_later(
+                    AWIM_LOG_COALESCE_SECONDS - elapsed,
+                    self._flush_repeated_log,
+                )
             return
 
-        waiting_match = WAITING_ATTEMPT_RE.search(message)
+        self._flush_repeated_log()
+        decky.logger.info('awim %s: %s', stream_name, message)
+        self._last_log_key = log_key
+        self._last_log_at = now
+
+    def _flush_repeated_log(self):
+        if self._repeated_log_flush is not None:
+            self._repeated_log_flush.cancel()
+            self._repeated_log_flush = None
+
+        if self._repeated_log_count and self._last_log_key is not None:
+            decky.logger.info(
+                'awim %s: %s (x%d)',
+                self._last_log_key[0],
+                self._repeated_log_message,
+                self._repeated_log_count,
+            )
+        self._repeated_log_count = 0
+
+    def _update_connection_status_from_log(self, message: str) -> str | None:
+        # Events are prioritized connected > waiting > reset regardless of position.
+        waiting_match: re.Match[str] | None = None
+        reset_seen = False
+        for match in LOG_EVENT_RE.finditer(message):
+            event = match.lastgroup
+            if event == 'connected':
+                self._set_connected_status()
+                return event
+            if event == 'waiting':
+                waiting_match = match
+                break
+            reset_seen = True
+
         if waiting_match is not None:
-            raw_attempt = waiting_match.group(1)
+            raw_attempt = waiting_match.group('attempt')
             attempt = int(raw_attempt) if raw_attempt is not None else self._next_waiting_attempt()
             self._set_waiting_status(attempt)
-            return
-
-        lowered = message.lower()
-        if 'connection reset' in lowered or 'connection closed' in lowered:
+            return 'waiting'
+        if reset_seen:
             self._set_waiting_status(self._next_waiting_attempt())
+            return 'reset'
+        return None
 
     def _collect_error_markers(self, message: str):
         lowered = message.lower()
@@ -456,37 +602,29 @@ class Plugin:
                 self._error_markers.add(marker)
 
     def _next_waiting_attempt(self) -> int:
-        if self.waiting_attempt is None:
+        waiting_attempt = self._status.waiting_attempt
+        if waiting_attempt is None:
             return 1
-        return self.waiting_attempt + 1
+        return waiting_attempt + 1
 
     async def _cancel_stream_tasks(self):
-        for task in [self.awim_stdout_task, self.awim_stderr_task]:
-            if task is None:
-                continue
-            if not task.done():
-                task.cancel()
-                with suppress(asyncio.CancelledError):
-                    await task
-
+        await self._cancel_tasks([self.awim_stdout_task, self.awim_stderr_task])
         self.awim_stdout_task = None
         self.awim_stderr_task = None
 
-    async def _cancel_exit_task(self):
-        task = self.awim_exit_task
-        if task is None:
-            return
-
-        if not task.done():
-            task.cancel()
-            with suppress(asyncio.CancelledError):
-                await task
-
+    async def _cancel_process_tasks(self):
+        await self._cancel_tasks([self.awim_stdout_task, self.awim_stderr_task, self.awim_exit_task])
+        self.awim_stdout_task = None
+        self.awim_stderr_task = None
         self.awim_exit_task = None
 
-    async def _cancel_process_tasks(self):
-        await self._cancel_stream_tasks()
-        await self._cancel_exit_task()
+    @staticmethod
+    async def _cancel_tasks(tasks: list[asyncio.Task[None] | None]):
+        pending = [task for task in tasks if task is not None and not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
 
     @staticmethod
     def _first_existing_path(candidates: list[str]) -> str | None:
@@ -503,6 +641,11 @@ class Plugin:
         if discovered is not None:
             env[key] = discovered
 
+    def _get_awim_env(self) -> dict[str, str]:
+        if self._awim_env is None:
+            self._awim_env = self._build_awim_env()
+        return self._awim_env
+
     def _build_awim_env(self) -> dict[str, str]:
         env = os.environ.copy()
         env.setdefault('XDG_RUNTIME_DIR', f'/run/user/{os.getuid()}')